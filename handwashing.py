@@ -1,11 +1,20 @@
 # app.py
 # Semmelweis Clinic 1 vs Clinic 2 — Yearly Dashboard (reads CSV from GitHub)
 
-import re
+import numpy as np
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 import streamlit as st
 
+from semmelweis import NUM_COLS, load_yearly
+
+# `filtered` below is a view into the shared cached frame; Copy-on-Write keeps any
+# future edit to it from writing through. It is always on from pandas 3.0, where
+# the option is deprecated, so only opt in on older versions.
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
 st.set_page_config(page_title="Semmelweis Clinics Dashboard", layout="wide")
 
 st.title("Semmelweis Clinic 1 vs Clinic 2 — Mortality Dashboard (Yearly)")
@@ -23,54 +32,49 @@ GITHUB_CSV_URL = (
     "semmelweis_yearly.csv"
 )
 
-@st.cache_data
-def load_data_from_github(url: str) -> pd.DataFrame:
-    df = pd.read_csv(url)
-
-    # Expected CSV headers (must match exactly)
-    rename_map = {
-        "Year": "year_label",
-        "Births in Clinic 1": "births_clinic1",
-        "Deaths in Clinic 1": "deaths_clinic1",
-        "Births in Clinic 2": "births_clinic2",
-        "Deaths in Clinic 2": "deaths_clinic2",
-    }
-
-    missing = [c for c in rename_map.keys() if c not in df.columns]
-    if missing:
-        raise ValueError(
-            "Missing columns in CSV: "
-            + ", ".join(missing)
-            + ". Make sure your CSV headers match exactly."
+# Data table page size: rows shown by default and the smallest step of the control
+DEFAULT_TABLE_ROWS = 500
+MIN_TABLE_ROWS = 100
+
+# Above this many rows the line chart is downsampled before it goes to the browser
+MAX_PLOT_POINTS = 2000
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets downsampling.
+
+    Returns the (sorted) indices of the n_out points to keep; x must be sorted.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # First and last points are always kept; the rest are split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[hi:next_hi].mean()
+        avg_y = y[hi:next_hi].mean()
+
+        # Pick the point in this bucket that forms the largest triangle with the
+        # previously kept point and the average of the next bucket
+        area = np.abs(
+            (x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a])
         )
+        a = lo + int(area.argmax())
+        keep[i + 1] = a
 
-    df = df.rename(columns=rename_map)
-
-    # Extract numeric year for sorting/filtering (handles '1847 (Before ...)' etc.)
-    def extract_year(x):
-        m = re.search(r"\d{4}", str(x))
-        return int(m.group(0)) if m else None
-
-    df["year"] = df["year_label"].apply(extract_year)
-    df = df.dropna(subset=["year"]).sort_values("year")
-
-    # Ensure numeric births/deaths
-    num_cols = ["births_clinic1", "deaths_clinic1", "births_clinic2", "deaths_clinic2"]
-    for c in num_cols:
-        df[c] = pd.to_numeric(df[c], errors="coerce")
-    df = df.dropna(subset=num_cols)
-
-    # Compute death rates
-    df["death_rate_c1"] = df["deaths_clinic1"] / df["births_clinic1"]
-    df["death_rate_c2"] = df["deaths_clinic2"] / df["births_clinic2"]
-
-    return df
+    return keep
 
 # -------------------------
 # Load data
 # -------------------------
 try:
-    df = load_data_from_github(GITHUB_CSV_URL)
+    df, clinic_long, data_version = load_yearly(GITHUB_CSV_URL)
 except Exception as e:
     st.error(
         "Could not load the CSV from GitHub.\n\n"
@@ -96,7 +100,17 @@ start_year, end_year = st.sidebar.slider(
     value=(min_year, max_year),
 )
 
-filtered = df[(df["year"] >= start_year) & (df["year"] <= end_year)].copy()
+high_res = st.sidebar.toggle(
+    "High-resolution",
+    value=False,
+    help=f"Plot every point instead of downsampling ranges with more than {MAX_PLOT_POINTS:,} rows.",
+)
+
+# df is sorted by year, so the range is a contiguous block of rows
+year_values = df["year"].to_numpy()
+lo = np.searchsorted(year_values, start_year, side="left")
+hi = np.searchsorted(year_values, end_year, side="right")
+filtered = df.iloc[lo:hi]
 
 # -------------------------
 # KPIs
@@ -104,12 +118,11 @@ filtered = df[(df["year"] >= start_year) & (df["year"] <= end_year)].copy()
 def safe_rate(deaths, births):
     return (deaths / births) if births and births != 0 else 0.0
 
-births_c1 = float(filtered["births_clinic1"].sum())
-deaths_c1 = float(filtered["deaths_clinic1"].sum())
+# One reduction over the 2D block instead of four separate Series sums
+births_c1, deaths_c1, births_c2, deaths_c2 = (
+    filtered[NUM_COLS].to_numpy(dtype=np.float64).sum(axis=0).tolist()
+)
 rate_c1 = safe_rate(deaths_c1, births_c1)
-
-births_c2 = float(filtered["births_clinic2"].sum())
-deaths_c2 = float(filtered["deaths_clinic2"].sum())
 rate_c2 = safe_rate(deaths_c2, births_c2)
 
 st.subheader("Overall Summary")
@@ -127,52 +140,107 @@ st.divider()
 # -------------------------
 # Charts
 # -------------------------
+# Year ranges whose figures are kept (per chart); the least recently used is
+# evicted first, so the cache stays small however wide the year span is
+MAX_CACHED_FIGURES = 32
+
+# Figures are cached per (data version, year range) so flipping the slider back
+# to a range seen before skips rebuilding the figure spec. The frame itself is
+# passed unhashed (leading underscore); data_version from load_yearly is what
+# keys it, so a reloaded CSV can never be drawn with figures built from the old
+# one. They are shared objects: hand them to st.plotly_chart, don't modify them.
+@st.cache_resource(max_entries=MAX_CACHED_FIGURES)
+def build_rate_figure(
+    _clinic_long: pd.DataFrame,
+    data_version: str,
+    start_year: int,
+    end_year: int,
+    high_res: bool,
+) -> go.Figure:
+    in_range = _clinic_long[_clinic_long["year"].between(start_year, end_year)]
+    rate_df = in_range[["year", "year_label", "death_rate", "clinic"]]
+    # rate_df holds one row per year for each of the two clinics
+    if not high_res and len(rate_df) > 2 * MAX_PLOT_POINTS:
+        parts = []
+        for _, clinic_df in rate_df.groupby("clinic", observed=True, sort=False):
+            keep = lttb(
+                clinic_df["year"].to_numpy(dtype=np.float64),
+                clinic_df["death_rate"].to_numpy(dtype=np.float64),
+                MAX_PLOT_POINTS,
+            )
+            parts.append(clinic_df.iloc[keep])
+        rate_df = pd.concat(parts)
+
+    fig = px.line(
+        rate_df,
+        x="year_label",
+        y="death_rate",
+        color="clinic",
+        markers=True,
+        render_mode="webgl",
+        labels={"year_label": "Year", "death_rate": "Death Rate", "clinic": "Clinic"},
+        title="Yearly Death Rates (Deaths / Births)",
+    )
+    fig.update_yaxes(tickformat=".1%")
+    return fig
+
+@st.cache_resource(max_entries=MAX_CACHED_FIGURES)
+def build_deaths_figure(
+    _clinic_long: pd.DataFrame, data_version: str, start_year: int, end_year: int
+) -> go.Figure:
+    in_range = _clinic_long[_clinic_long["year"].between(start_year, end_year)]
+    deaths_df = in_range[["year_label", "deaths", "clinic"]]
+
+    return px.bar(
+        deaths_df,
+        x="year_label",
+        y="deaths",
+        color="clinic",
+        barmode="group",
+        labels={"year_label": "Year", "deaths": "Deaths", "clinic": "Clinic"},
+        title="Yearly Death Counts",
+    )
+
 left, right = st.columns(2)
 
 # Line chart: death rates
-rate_df = filtered[["year", "year_label", "death_rate_c1", "death_rate_c2"]].melt(
-    id_vars=["year", "year_label"],
-    var_name="clinic",
-    value_name="death_rate",
-)
-rate_df["clinic"] = rate_df["clinic"].map(
-    {"death_rate_c1": "Clinic 1", "death_rate_c2": "Clinic 2"}
-)
-
-fig_line = px.line(
-    rate_df.sort_values("year"),
-    x="year_label",
-    y="death_rate",
-    color="clinic",
-    markers=True,
-    labels={"year_label": "Year", "death_rate": "Death Rate", "clinic": "Clinic"},
-    title="Yearly Death Rates (Deaths / Births)",
-)
-fig_line.update_yaxes(tickformat=".1%")
+fig_line = build_rate_figure(clinic_long, data_version, start_year, end_year, high_res)
 left.plotly_chart(fig_line, use_container_width=True)
 
 # Bar chart: deaths
-deaths_df = filtered[["year", "year_label", "deaths_clinic1", "deaths_clinic2"]].melt(
-    id_vars=["year", "year_label"],
-    var_name="clinic",
-    value_name="deaths",
-)
-deaths_df["clinic"] = deaths_df["clinic"].map(
-    {"deaths_clinic1": "Clinic 1", "deaths_clinic2": "Clinic 2"}
-)
-
-fig_bar = px.bar(
-    deaths_df.sort_values("year"),
-    x="year_label",
-    y="deaths",
-    color="clinic",
-    barmode="group",
-    labels={"year_label": "Year", "deaths": "Deaths", "clinic": "Clinic"},
-    title="Yearly Death Counts",
-)
+fig_bar = build_deaths_figure(clinic_long, data_version, start_year, end_year)
 right.plotly_chart(fig_bar, use_container_width=True)
 
 with st.expander("Show data table"):
-    st.dataframe(filtered, use_container_width=True)
+    # Only the requested rows are sent to the browser, not the whole range
+    total_rows = len(filtered)
+    if total_rows > MIN_TABLE_ROWS:
+        shown_rows = st.number_input(
+            "Rows",
+            min_value=MIN_TABLE_ROWS,
+            max_value=total_rows,
+            value=min(DEFAULT_TABLE_ROWS, total_rows),
+            step=MIN_TABLE_ROWS,
+        )
+    else:
+        shown_rows = total_rows
+
+    st.dataframe(
+        filtered.head(shown_rows),
+        column_config={
+            "year_label": st.column_config.TextColumn("Year"),
+            "year": st.column_config.NumberColumn("Year (numeric)", format="%d"),
+            "births_clinic1": st.column_config.NumberColumn("Births (Clinic 1)", format="%d"),
+            "deaths_clinic1": st.column_config.NumberColumn("Deaths (Clinic 1)", format="%d"),
+            "births_clinic2": st.column_config.NumberColumn("Births (Clinic 2)", format="%d"),
+            "deaths_clinic2": st.column_config.NumberColumn("Deaths (Clinic 2)", format="%d"),
+            "death_rate_c1": st.column_config.NumberColumn("Death Rate (Clinic 1)", format="percent"),
+            "death_rate_c2": st.column_config.NumberColumn("Death Rate (Clinic 2)", format="percent"),
+        },
+        hide_index=True,
+        use_container_width=True,
+    )
+    if shown_rows < total_rows:
+        st.caption(f"Showing the first {shown_rows:,} of {total_rows:,} rows.")
 
 st.caption("Make sure your CSV headers match exactly: Year, Births in Clinic 1, Deaths in Clinic 1, Births in Clinic 2, Deaths in Clinic 2.")
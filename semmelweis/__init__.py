@@ -0,0 +1,5 @@
+# semmelweis/__init__.py
+
+from .loader import NUM_COLS, load_yearly
+
+__all__ = ["NUM_COLS", "load_yearly"]
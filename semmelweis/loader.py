@@ -0,0 +1,223 @@
+# semmelweis/loader.py
+# Shared CSV fetch + cleaning pipeline for the Semmelweis dashboards
+
+import hashlib
+import io
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import requests
+import streamlit as st
+
+# Births/deaths columns after renaming (order matters for the KPI totals in the app)
+NUM_COLS = ["births_clinic1", "deaths_clinic1", "births_clinic2", "deaths_clinic2"]
+
+# First 4-digit run in a year label ('1847 (Before Handwashing)' -> '1847')
+_YEAR_RE = re.compile(r"(\d{4})")
+
+# How long a loaded frame is reused before the next load revalidates the
+# upstream CSV
+CACHE_TTL = 3600
+
+# On-disk cache, one subdirectory per source URL (see _cache_dir). Each holds:
+# - the downloaded CSV plus its ETag, so cold starts can revalidate with a
+#   conditional GET instead of re-downloading the whole file
+# - the cleaned frame built from that CSV, tagged with the ETag it was built
+#   from, so a cold start with an unchanged upstream file skips the cleaning
+CACHE_DIR = Path.home() / ".cache" / "handwashing"
+CACHE_CSV_NAME = "source.csv"
+CACHE_ETAG_NAME = "source.csv.etag"
+CLEAN_PARQUET_NAME = "clean.parquet"
+CLEAN_ETAG_NAME = "clean.parquet.etag"
+
+# Bump whenever _clean_yearly's output changes (columns, dtypes, formulas), so
+# sidecars written by an older version are rebuilt instead of served as-is
+_CLEAN_VERSION = 4
+
+def _cache_dir(url: str) -> Path:
+    return CACHE_DIR / hashlib.sha256(url.encode()).hexdigest()[:16]
+
+def _fetch_csv_bytes(url: str) -> tuple[bytes, str | None]:
+    """Return the CSV body and the ETag of that body (None if the server sent none)."""
+    cache_dir = _cache_dir(url)
+    csv_path = cache_dir / CACHE_CSV_NAME
+    etag_path = cache_dir / CACHE_ETAG_NAME
+
+    headers = {}
+    if csv_path.exists() and etag_path.exists():
+        headers["If-None-Match"] = etag_path.read_text().strip()
+
+    try:
+        resp = requests.get(url, headers=headers, timeout=10)
+        resp.raise_for_status()
+    except requests.RequestException:
+        # Offline or GitHub hiccup: fall back to the last good copy if we have one
+        if csv_path.exists():
+            return csv_path.read_bytes(), _read_text(etag_path)
+        raise
+
+    if resp.status_code == 304:
+        return csv_path.read_bytes(), _read_text(etag_path)
+
+    data = resp.content
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    csv_path.write_bytes(data)
+    etag = resp.headers.get("ETag")
+    if etag:
+        etag_path.write_text(etag)
+    elif etag_path.exists():
+        etag_path.unlink()
+    return data, etag
+
+def _read_text(path: Path) -> str | None:
+    return path.read_text().strip() if path.exists() else None
+
+def _clean_yearly(source) -> pd.DataFrame:
+    """Parse the raw yearly CSV and return the wide per-year frame sorted by year."""
+    # Expected CSV headers (must match exactly)
+    rename_map = {
+        "Year": "year_label",
+        "Births in Clinic 1": "births_clinic1",
+        "Deaths in Clinic 1": "deaths_clinic1",
+        "Births in Clinic 2": "births_clinic2",
+        "Deaths in Clinic 2": "deaths_clinic2",
+    }
+
+    # Parse with Arrow's CSV reader and explicit dtypes so no per-column type
+    # inference or numeric coercion pass is needed afterwards. Counts are read as
+    # Int64 because pandas' cast to a narrower dtype wraps large values; the
+    # range-checked downcast to int32 happens below.
+    dtypes = {c: "Int64" for c in rename_map if c != "Year"}
+    dtypes["Year"] = "str"
+    try:
+        df = pd.read_csv(source, engine="pyarrow", dtype=dtypes)
+        needs_coercion = False
+    except ValueError:
+        # Non-numeric cells upstream (Arrow refuses the int cast): re-read with
+        # inference and coerce the counts below instead
+        if hasattr(source, "seek"):
+            source.seek(0)
+        df = pd.read_csv(source, dtype={"Year": "str"})
+        needs_coercion = True
+
+    missing = [c for c in rename_map.keys() if c not in df.columns]
+    if missing:
+        raise ValueError(
+            "Missing columns in CSV: "
+            + ", ".join(missing)
+            + ". Make sure your CSV headers match exactly."
+        )
+
+    df = df.rename(columns=rename_map)
+
+    # Extract numeric year for sorting/filtering (handles '1847 (Before ...)' etc.)
+    years = df["year_label"].astype(str).str.extract(_YEAR_RE, expand=False)
+    df["year"] = pd.to_numeric(years, errors="coerce").astype("Int64")
+    # The app's year filter slices by position, which relies on this sort
+    df = df.dropna(subset=["year"]).sort_values("year")
+    # No missing years are left, so drop the mask: a plain int64 column gives
+    # zero-copy access to the sorted year array for range lookups
+    df["year"] = df["year"].astype("int64")
+
+    # Births/deaths are already numeric from the parser (unless we fell back above);
+    # just drop incomplete rows and store them as plain int32 (small non-negative counts)
+    if needs_coercion:
+        counts = df[NUM_COLS].apply(pd.to_numeric, errors="coerce")
+        # Fractional, negative or oversized counts are not valid data; blank them
+        # so the row is dropped below instead of being truncated or wrapped by the
+        # int32 cast
+        valid = (counts % 1 == 0) & counts.ge(0) & counts.le(np.iinfo(np.int32).max)
+        df[NUM_COLS] = counts.where(valid)
+    df = df.dropna(subset=NUM_COLS)
+    # astype would wrap out-of-range values around silently, so check first
+    int32 = np.iinfo(np.int32)
+    out_of_range = ((df[NUM_COLS] < int32.min) | (df[NUM_COLS] > int32.max)).any()
+    if out_of_range.any():
+        raise ValueError(
+            "Births/deaths values out of int32 range in columns: "
+            + ", ".join(out_of_range[out_of_range].index)
+        )
+    df[NUM_COLS] = df[NUM_COLS].astype("int32")
+
+    # Compute death rates straight on the NumPy buffers (no index alignment);
+    # years with zero births get a rate of 0 instead of inf/NaN. float32 is
+    # plenty for a ratio that is only displayed.
+    for suffix, births_col, deaths_col in (
+        ("c1", "births_clinic1", "deaths_clinic1"),
+        ("c2", "births_clinic2", "deaths_clinic2"),
+    ):
+        births = df[births_col].to_numpy(dtype=np.float64)
+        deaths = df[deaths_col].to_numpy(dtype=np.float64)
+        df[f"death_rate_{suffix}"] = np.divide(
+            deaths, births, out=np.zeros_like(births), where=births != 0
+        ).astype(np.float32)
+
+    return df
+
+CLINICS = pd.CategoricalDtype(["Clinic 1", "Clinic 2"], ordered=True)
+
+def _build_long(df: pd.DataFrame) -> pd.DataFrame:
+    # Long-form frame for both charts, built once at load so reruns only slice it:
+    # Clinic 1 rows followed by Clinic 2 rows, each block in df's year order, so
+    # the charts need no re-sort
+    n = len(df)
+    return pd.DataFrame(
+        {
+            "year": np.tile(df["year"].to_numpy(), 2),
+            "year_label": np.tile(df["year_label"].to_numpy(), 2),
+            "clinic": pd.Categorical.from_codes(np.repeat([0, 1], n), dtype=CLINICS),
+            "deaths": np.concatenate(
+                [df["deaths_clinic1"].to_numpy(), df["deaths_clinic2"].to_numpy()]
+            ),
+            "death_rate": np.concatenate(
+                [df["death_rate_c1"].to_numpy(), df["death_rate_c2"].to_numpy()]
+            ),
+        }
+    )
+
+# cache_resource hands back the same in-memory DataFrame on every rerun instead of
+# pickling and hashing a copy like cache_data does (see Streamlit's "Dealing with
+# large data" guidance). The cached frame is shared, so callers must treat it as
+# read-only and copy explicitly before mutating. Expiring the entry after
+# CACHE_TTL is what makes a running server revalidate the upstream ETag.
+@st.cache_resource(ttl=CACHE_TTL)
+def load_yearly(url_or_file: str) -> tuple[pd.DataFrame, pd.DataFrame, str]:
+    """Load and clean the yearly CSV from a URL or a local file path.
+
+    Returns (df, clinic_long, data_version): the wide per-year frame sorted by
+    year, the long-form (year, year_label, clinic, deaths, death_rate) frame the
+    charts slice by year range, and a token that changes whenever the cleaned
+    data may have changed (for keying caches built from these frames).
+    """
+    if not url_or_file.startswith(("http://", "https://")):
+        data = Path(url_or_file).read_bytes()
+        df = _clean_yearly(io.BytesIO(data))
+        data_version = f"{_CLEAN_VERSION}:{hashlib.sha256(data).hexdigest()}"
+        return df, _build_long(df), data_version
+
+    data, etag = _fetch_csv_bytes(url_or_file)
+    if etag is None:
+        data_version = f"{_CLEAN_VERSION}:{hashlib.sha256(data).hexdigest()}"
+        df = _clean_yearly(io.BytesIO(data))
+        return df, _build_long(df), data_version
+
+    # The sidecar is only valid for this upstream file *and* this cleaning pipeline
+    data_version = f"{_CLEAN_VERSION}:{etag}"
+    cache_dir = _cache_dir(url_or_file)
+    parquet_path = cache_dir / CLEAN_PARQUET_NAME
+    parquet_etag_path = cache_dir / CLEAN_ETAG_NAME
+    if parquet_path.exists() and _read_text(parquet_etag_path) == data_version:
+        df = pd.read_parquet(parquet_path, engine="pyarrow")
+    else:
+        df = _clean_yearly(io.BytesIO(data))
+        # Invalidate the old tag first and write via a temp file, so a crash
+        # never leaves a sidecar that looks valid but is stale or half-written
+        parquet_etag_path.unlink(missing_ok=True)
+        tmp_path = parquet_path.with_suffix(".parquet.tmp")
+        df.to_parquet(tmp_path, engine="pyarrow", compression="zstd")
+        tmp_path.replace(parquet_path)
+        parquet_etag_path.write_text(data_version)
+
+    return df, _build_long(df), data_version